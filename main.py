@@ -1,18 +1,22 @@
+import contextlib
 import hashlib
 import hmac
 import os
+import time
 import urllib.parse
 
 import httpx
+import orjson
 import uvicorn
 from starlette.applications import Starlette
+from starlette.background import BackgroundTask
 from starlette.middleware import Middleware
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
 from starlette.responses import StreamingResponse, JSONResponse
 from starlette.routing import Route
 
 from sign_s3 import generate_presigned_url_v4, generate_presigned_url_v2
-from signature_helpers import calculate_signature_v4, calculate_signature_v2
+from signature_helpers import calculate_signature_v2, make_v4_signer
 
 # Configuration
 # Client-facing credentials (what clients use to sign requests to this proxy)
@@ -27,57 +31,173 @@ ORIGIN_DOMAIN = os.getenv("ORIGIN_DOMAIN", "s3.example.com")
 ORIGIN_SCHEME = os.getenv("ORIGIN_SCHEME", "https")
 PORT = int(os.getenv("PORT", "8000"))
 
+ORIGIN_URL_PREFIX = f"{ORIGIN_SCHEME}://{ORIGIN_DOMAIN}"
 
-def detect_signature_version(query_params):
-    """Detect signature version from query parameters
+# V4 signer for verifying client requests, specialised for the client secret
+client_v4_signer = make_v4_signer(CLIENT_SECRET_KEY, '')
+
+# Request headers that must not be forwarded to origin (hop-by-hop headers are
+# rejected outright on HTTP/2 connections)
+EXCLUDED_REQUEST_HEADERS = frozenset({
+    b'host', b'content-length', b'connection', b'keep-alive', b'proxy-connection', b'te', b'transfer-encoding',
+    b'upgrade'
+})
+
+# Methods whose request body is streamed to origin
+BODY_METHODS = frozenset({'POST', 'PUT', 'PATCH'})
+
+# Shared origin client so connections (and TLS sessions) are reused across requests
+http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=100, max_connections=200),
+    timeout=30.0
+)
+
+# Pre-quoted names of the standard SigV4 query parameters
+_QUOTED_KEYS = {
+    key: urllib.parse.quote(key, safe='')
+    for key in ('X-Amz-Algorithm', 'X-Amz-Credential', 'X-Amz-Date', 'X-Amz-Expires', 'X-Amz-SignedHeaders')
+}
+
+# Query parameters of a standard presigned V4 URL, and its canonical query
+# string with the keys already in sorted order
+_STANDARD_V4_QUERY_KEYS = frozenset(_QUOTED_KEYS) | {'X-Amz-Signature'}
+_STANDARD_V4_CANONICAL_QUERY = (
+    "X-Amz-Algorithm={algorithm}&X-Amz-Credential={credential}&X-Amz-Date={date}"
+    "&X-Amz-Expires={expires}&X-Amz-SignedHeaders={signed_headers}"
+)
+
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse serialized with orjson"""
+
+    def render(self, content):
+        return orjson.dumps(content)
+
+
+def detect_signature_version(query_string):
+    """Detect signature version from the raw query string
+
+    Checks the undecoded bytes from the ASGI scope so unsigned requests never
+    need their query string parsed. Parameter names are matched at parameter
+    boundaries only, so the same text inside a value doesn't count.
+
+    Args:
+        query_string: Raw query string bytes
 
     Returns:
         tuple: (is_v4, is_v2) booleans
     """
-    is_v4 = 'X-Amz-Signature' in query_params
-    is_v2 = 'Signature' in query_params and 'AWSAccessKeyId' in query_params
+    is_v4 = query_string.startswith(b'X-Amz-Signature=') or b'&X-Amz-Signature=' in query_string
+    is_v2 = (
+        (query_string.startswith(b'Signature=') or b'&Signature=' in query_string)
+        and (query_string.startswith(b'AWSAccessKeyId=') or b'&AWSAccessKeyId=' in query_string)
+    )
     return is_v4, is_v2
 
 
-class AWSSignatureVerificationMiddleware(BaseHTTPMiddleware):
-    """Middleware to verify AWS signatures before processing requests"""
+def build_canonical_request(method, path, query_params, host, headers, signed_headers):
+    """Build the AWS Signature V4 canonical request for an incoming request
+
+    Returns:
+        str: Canonical request string
+    """
+    # Create canonical query string (exclude signature)
+    quote = urllib.parse.quote
+    if query_params.keys() == _STANDARD_V4_QUERY_KEYS and sum(map(len, query_params.values())) == len(query_params):
+        # Standard presigned URL: fill the pre-sorted template, no sort or loop
+        canonical_querystring = _STANDARD_V4_CANONICAL_QUERY.format(
+            algorithm=quote(query_params['X-Amz-Algorithm'][0], safe=''),
+            credential=quote(query_params['X-Amz-Credential'][0], safe=''),
+            date=quote(query_params['X-Amz-Date'][0], safe=''),
+            expires=quote(query_params['X-Amz-Expires'][0], safe=''),
+            signed_headers=quote(query_params['X-Amz-SignedHeaders'][0], safe='')
+        )
+    else:
+        canonical_querystring = "&".join(
+            f"{_QUOTED_KEYS.get(key) or quote(key, safe='')}={quote(value, safe='')}"
+            for key, values in sorted(query_params.items())
+            if key != 'X-Amz-Signature'
+            for value in values
+        )
+
+    # Create canonical headers
+    signed_headers_list = signed_headers.split(';')
+    signed_headers_list.sort()
+    canonical_headers = []
+    for header in signed_headers_list:
+        if header == 'host':
+            canonical_headers.append(f"host:{host}\n")
+        elif header.lower() in headers:
+            canonical_headers.append(f"{header}:{headers[header.lower()].strip()}\n")
+
+    payload_hash = "UNSIGNED-PAYLOAD"
+    return "\n".join(
+        (method, path, canonical_querystring, "".join(canonical_headers), signed_headers, payload_hash)
+    )
+
+
+class AWSSignatureVerificationMiddleware:
+    """ASGI middleware to verify AWS signatures before processing requests"""
 
     def __init__(self, app):
-        super().__init__(app)
+        self.app = app
 
-    async def dispatch(self, request, call_next):
-        # Parse query parameters
-        query_params = parse_query_params(request.url.query)
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] == '/healthz':
+            await self.app(scope, receive, send)
+            return
 
         # Detect signature version
-        is_v4, is_v2 = detect_signature_version(query_params)
+        is_v4, is_v2 = detect_signature_version(scope['query_string'])
 
         # Skip verification for non-signed requests (pass through)
         if not is_v4 and not is_v2:
-            return await call_next(request)
+            await self.app(scope, receive, send)
+            return
+
+        error_response = self.verify_request(Request(scope), is_v4, is_v2)
+        if error_response is not None:
+            await error_response(scope, receive, send)
+            return
+
+        # Signature is valid, proceed with request
+        await self.app(scope, receive, send)
+
+    def verify_request(self, request, is_v4, is_v2):
+        """Verify the request signature
+
+        Returns:
+            ORJSONResponse: error response if verification failed, None otherwise
+        """
+        # Parse query parameters
+        query_params = parse_query_params(request.url.query)
 
         # Verify AWS signature
         try:
             if is_v4:
                 if not self.verify_signature_v4(request, query_params):
-                    return JSONResponse(
+                    return ORJSONResponse(
                         {"error": "Invalid AWS signature V4"},
                         status_code=403
                     )
             elif is_v2:
                 if not self.verify_signature_v2(request, query_params):
-                    return JSONResponse(
+                    return ORJSONResponse(
                         {"error": "Invalid AWS signature V2"},
                         status_code=403
                     )
         except Exception as e:
-            return JSONResponse(
+            return ORJSONResponse(
                 {"error": f"Signature verification failed: {str(e)}"},
                 status_code=400
             )
 
-        # Signature is valid, proceed with request
-        return await call_next(request)
+        # Hand the verified parameters on so the handler doesn't re-parse them
+        request.state.query_params = query_params
+        request.state.is_v4 = is_v4
+        request.state.is_v2 = is_v2
+        return None
 
     def verify_signature_v4(self, request, query_params):
         """Verify the AWS Signature V4"""
@@ -101,51 +221,30 @@ class AWSSignatureVerificationMiddleware(BaseHTTPMiddleware):
 
         # Calculate expected signature with the incoming host
         incoming_host = request.headers.get('host', '')
-        expected_signature = self.calculate_signature_v4(
+        expected_digest = self.calculate_signature_v4(
             method=request.method,
             host=incoming_host,
-            path=request.url.path,
+            path=urllib.parse.quote(request.url.path, safe='/'),
             query_params=query_params,
-            headers=dict(request.headers),
+            headers=request.headers,
             amz_date=amz_date,
             signed_headers=signed_headers
         )
 
-        # Compare signatures
-        return hmac.compare_digest(provided_signature, expected_signature)
+        # Compare against the exact lowercase hex form; bytes.fromhex would also
+        # accept uppercase and whitespace, making the signature malleable
+        return hmac.compare_digest(provided_signature.encode('utf-8'), expected_digest.hex().encode('ascii'))
 
     def calculate_signature_v4(self, method, host, path, query_params, headers, amz_date, signed_headers):
-        """Calculate AWS Signature V4"""
+        """Calculate AWS Signature V4 as a raw digest"""
 
         date_stamp = amz_date[:8]
         credential_scope = f"{date_stamp}//s3/aws4_request"
 
-        # Create canonical query string (exclude signature)
-        canonical_querystring_parts = []
-        for key, values in sorted(query_params.items()):
-            if key == 'X-Amz-Signature':
-                continue
-            for value in values:
-                canonical_querystring_parts.append(
-                    f"{urllib.parse.quote(key, safe='')}={urllib.parse.quote(str(value), safe='')}"
-                )
-        canonical_querystring = "&".join(canonical_querystring_parts)
-
-        # Create canonical headers
-        signed_headers_list = signed_headers.split(';')
-        canonical_headers = ""
-        for header in sorted(signed_headers_list):
-            if header == 'host':
-                canonical_headers += f"host:{host}\n"
-            elif header.lower() in headers:
-                canonical_headers += f"{header}:{headers[header.lower()].strip()}\n"
-
-        # Create canonical request
-        payload_hash = "UNSIGNED-PAYLOAD"
-        canonical_request = f"{method}\n{path}\n{canonical_querystring}\n{canonical_headers}\n{signed_headers}\n{payload_hash}"
+        canonical_request = build_canonical_request(method, path, query_params, host, headers, signed_headers)
 
-        # Use helper function from signature_helpers
-        return calculate_signature_v4(CLIENT_SECRET_KEY, date_stamp, amz_date, credential_scope, canonical_request, '')
+        # Use the signer built for the client credentials
+        return client_v4_signer(date_stamp, amz_date, credential_scope, canonical_request)
 
     def verify_signature_v2(self, request, query_params):
         """Verify AWS Signature V2"""
@@ -192,25 +291,37 @@ def parse_query_params(query_string):
                 key, value = param.split('=', 1)
                 key = urllib.parse.unquote(key)
                 value = urllib.parse.unquote(value)
-                if key in params:
-                    params[key].append(value)
-                else:
-                    params[key] = [value]
+            elif param:
+                # Valueless parameters such as ?uploads are signed with an empty value
+                key = urllib.parse.unquote(param)
+                value = ''
+            else:
+                continue
+            if key in params:
+                params[key].append(value)
+            else:
+                params[key] = [value]
     return params
 
 
 def validate_and_resign_url(request):
     """Validate original signature and create new signature for origin domain"""
 
-    # Parse query parameters
-    query_params = parse_query_params(request.url.query)
+    # Reuse the parameters the middleware already parsed and verified
+    verified = hasattr(request.state, 'query_params')
+    if verified:
+        query_params = request.state.query_params
+        is_v4, is_v2 = request.state.is_v4, request.state.is_v2
+    else:
+        # Detect signature version
+        is_v4, is_v2 = detect_signature_version(request.scope['query_string'])
 
-    # Detect signature version
-    is_v4, is_v2 = detect_signature_version(query_params)
+        # Not a signed request, pass through
+        if not is_v4 and not is_v2:
+            return request.url.query
 
-    # Not a signed request, pass through
-    if not is_v4 and not is_v2:
-        return request.url.query
+        # Parse query parameters
+        query_params = parse_query_params(request.url.query)
 
     # Extract bucket and object from path
     path_parts = request.url.path.strip('/').split('/', 1)
@@ -222,9 +333,10 @@ def validate_and_resign_url(request):
     # Handle V4 signature
     if is_v4:
         # Verify the access key matches CLIENT credentials
-        credential = query_params.get('X-Amz-Credential', [''])[0]
-        if not credential.startswith(CLIENT_ACCESS_KEY):
-            raise ValueError("Access key mismatch")
+        if not verified:
+            credential = query_params.get('X-Amz-Credential', [''])[0]
+            if not credential.startswith(CLIENT_ACCESS_KEY):
+                raise ValueError("Access key mismatch")
 
         # Extract expires from original request
         expires_str = query_params.get('X-Amz-Expires', ['3600'])[0]
@@ -232,7 +344,7 @@ def validate_and_resign_url(request):
 
         # Generate new presigned URL using V4 (same as client)
         new_url = generate_presigned_url_v4(
-            endpoint=f"{ORIGIN_SCHEME}://{ORIGIN_DOMAIN}",
+            endpoint=ORIGIN_URL_PREFIX,
             access_key=ORIGIN_ACCESS_KEY,
             secret_key=ORIGIN_SECRET_KEY,
             bucket=bucket,
@@ -245,20 +357,20 @@ def validate_and_resign_url(request):
     # Handle V2 signature
     elif is_v2:
         # Verify the access key matches CLIENT credentials
-        access_key_id = query_params.get('AWSAccessKeyId', [''])[0]
-        if access_key_id != CLIENT_ACCESS_KEY:
-            raise ValueError("Access key mismatch")
+        if not verified:
+            access_key_id = query_params.get('AWSAccessKeyId', [''])[0]
+            if access_key_id != CLIENT_ACCESS_KEY:
+                raise ValueError("Access key mismatch")
 
         # Extract expires from original request
         expires_str = query_params.get('Expires', [''])[0]
-        import time
         current_timestamp = int(time.time())
         expires_timestamp = int(expires_str)
         expires_in = max(expires_timestamp - current_timestamp, 60)  # At least 60 seconds
 
         # Generate new presigned URL using V2 (same as client)
         new_url = generate_presigned_url_v2(
-            endpoint=f"{ORIGIN_SCHEME}://{ORIGIN_DOMAIN}",
+            endpoint=ORIGIN_URL_PREFIX,
             access_key=ORIGIN_ACCESS_KEY,
             secret_key=ORIGIN_SECRET_KEY,
             bucket=bucket,
@@ -279,34 +391,41 @@ async def proxy_handler(request):
         new_query_string = validate_and_resign_url(request)
 
         # Build target URL
-        target_url = f"{ORIGIN_SCHEME}://{ORIGIN_DOMAIN}{request.url.path}"
+        target_url = ORIGIN_URL_PREFIX + request.url.path
         if new_query_string:
             target_url += f"?{new_query_string}"
 
-        # Forward request to origin
-        async with httpx.AsyncClient() as client:
-            response = await client.request(
-                method=request.method,
-                url=target_url,
-                headers={k: v for k, v in request.headers.items()
-                         if k.lower() not in ['host', 'content-length']},
-                content=await request.body() if request.method in ['POST', 'PUT', 'PATCH'] else None
-            )
+        headers = [(k, v) for k, v in request.headers.raw
+                   if k.lower() not in EXCLUDED_REQUEST_HEADERS]
 
-            # Stream response back
-            def generate():
-                for chunk in response.iter_bytes():
-                    yield chunk
+        # Stream the request body through instead of buffering it, keeping the
+        # client's length so origin doesn't receive a chunked upload
+        content = None
+        if request.method in BODY_METHODS:
+            content = request.stream()
+            content_length = request.headers.get('content-length')
+            if content_length is not None:
+                headers.append((b'content-length', content_length.encode('latin-1')))
 
-            return StreamingResponse(
-                generate(),
-                status_code=response.status_code,
-                headers=dict(response.headers)
-            )
+        # Forward request to origin
+        origin_request = http_client.build_request(
+            method=request.method,
+            url=target_url,
+            headers=headers,
+            content=content
+        )
+        response = await http_client.send(origin_request, stream=True)
+
+        # Stream response back, releasing the connection once the body is sent
+        return StreamingResponse(
+            response.aiter_raw(),
+            status_code=response.status_code,
+            headers=dict(response.headers),
+            background=BackgroundTask(response.aclose)
+        )
 
     except Exception as e:
-        from starlette.responses import JSONResponse
-        return JSONResponse(
+        return ORJSONResponse(
             {"error": f"Proxy error: {str(e)}"},
             status_code=400
         )
@@ -315,14 +434,20 @@ async def proxy_handler(request):
 async def health_check(request):
     """Check if origin server is responding"""
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.head(f"{ORIGIN_SCHEME}://{ORIGIN_DOMAIN}")
-            if 200 <= response.status_code < 300:
-                return JSONResponse({"status": "ok"}, status_code=200)
+        response = await http_client.head(ORIGIN_URL_PREFIX, timeout=5.0)
+        if 200 <= response.status_code < 300:
+            return ORJSONResponse({"status": "ok"}, status_code=200)
     except Exception:
         pass
 
-    return JSONResponse({"status": "nok"}, status_code=450)
+    return ORJSONResponse({"status": "nok"}, status_code=450)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """Close the shared origin client on shutdown"""
+    yield
+    await http_client.aclose()
 
 
 # Routes
@@ -336,7 +461,7 @@ middleware = [
     Middleware(AWSSignatureVerificationMiddleware)
 ]
 
-app = Starlette(routes=routes, middleware=middleware)
+app = Starlette(routes=routes, middleware=middleware, lifespan=lifespan)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=PORT)
@@ -1,20 +1,42 @@
 import argparse
+import functools
 import hashlib
-from datetime import datetime, timedelta
+import time
 from urllib.parse import quote, urlencode
 
 from signature_helpers import calculate_signature_v2, calculate_signature_v4
 
+# (unix second, datestamp, timestamp) of the last formatted UTC second
+_stamp_cache = (0, '', '')
+
+
+def _now_stamps():
+    """Return (datestamp, timestamp) for the current UTC second, formatted at most once per second"""
+    global _stamp_cache
+    now = int(time.time())
+    cached = _stamp_cache
+    if cached[0] != now:
+        tm = time.gmtime(now)
+        datestamp = f"{tm.tm_year:04d}{tm.tm_mon:02d}{tm.tm_mday:02d}"
+        cached = _stamp_cache = (now, datestamp, f"{datestamp}T{tm.tm_hour:02d}{tm.tm_min:02d}{tm.tm_sec:02d}Z")
+    return cached[1], cached[2]
+
+
+@functools.lru_cache(maxsize=1024)
+def _quote_key(object_key):
+    """URI-encode an object key for use in both the URL and the canonical URI"""
+    return quote(object_key, safe='/')
+
 
 def generate_presigned_url_v2(endpoint, access_key, secret_key, bucket, object_key, expires_in, scheme='https'):
     """AWS Signature Version 2"""
     if not endpoint.startswith('http'):
         endpoint = f'{scheme}://{endpoint}'
 
-    expiration = int((datetime.utcnow() + timedelta(seconds=expires_in)).timestamp())
+    expiration = int(time.time()) + expires_in
     signature_b64 = calculate_signature_v2(secret_key, bucket, object_key, expiration)
 
-    url = f"{endpoint}/{bucket}/{quote(object_key, safe='/')}"
+    url = f"{endpoint}/{bucket}/{_quote_key(object_key)}"
     params = {
         'AWSAccessKeyId': access_key,
         'Expires': str(expiration),
@@ -36,9 +58,7 @@ def generate_presigned_url_v4(endpoint, access_key, secret_key, bucket, object_k
     host = parsed.netloc
 
     # Timestamps
-    now = datetime.utcnow()
-    datestamp = now.strftime('%Y%m%d')
-    timestamp = now.strftime('%Y%m%dT%H%M%SZ')
+    datestamp, timestamp = _now_stamps()
 
     # Credential scope
     credential_scope = f"{datestamp}/{region}/s3/aws4_request"
@@ -53,7 +73,8 @@ def generate_presigned_url_v4(endpoint, access_key, secret_key, bucket, object_k
     }
 
     # Canonical request
-    canonical_uri = f"/{bucket}/{object_key}"
+    quoted_key = _quote_key(object_key)
+    canonical_uri = f"/{bucket}/{quoted_key}"
     canonical_querystring = urlencode(sorted(params.items()))
     canonical_headers = f"host:{host}\n"
     signed_headers = 'host'
@@ -66,7 +87,7 @@ def generate_presigned_url_v4(endpoint, access_key, secret_key, bucket, object_k
 
     # Final URL
     params['X-Amz-Signature'] = signature
-    url = f"{endpoint}/{bucket}/{quote(object_key, safe='/')}"
+    url = f"{endpoint}/{bucket}/{quoted_key}"
 
     return f"{url}?{urlencode(sorted(params.items()))}"
 
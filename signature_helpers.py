@@ -1,8 +1,46 @@
 """Helper functions for AWS signature calculation shared between main.py and sign_s3.py"""
 
-import base64
+import asyncio
+import binascii
+import functools
 import hashlib
 import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Module-level bindings avoid attribute lookups on the signing hot paths
+_sha256 = hashlib.sha256
+_hmac_digest = hmac.digest
+_hmac_new = hmac.new
+_b2a_base64 = binascii.b2a_base64
+
+# Worker threads for signing off the event loop; OpenSSL drops the GIL while hashing larger inputs
+_CRYPTO_WORKERS = os.cpu_count() or 1
+_CRYPTO_POOL = ThreadPoolExecutor(max_workers=_CRYPTO_WORKERS, thread_name_prefix='signature')
+
+# Constant parts of the V4 signing key derivation and string to sign
+_ALGORITHM = b'AWS4-HMAC-SHA256'
+_S3 = b's3'
+_AWS4_REQUEST = b'aws4_request'
+
+
+def hash_canonical_request(canonical_request):
+    """Hash a V4 canonical request
+
+    Callers that need the hash themselves can pass its hex() to
+    calculate_signature_v4 as canonical_request_hash instead of hashing twice.
+
+    Returns:
+        32-byte SHA-256 digest
+    """
+    return _sha256(canonical_request.encode()).digest()
+
+
+@functools.lru_cache(maxsize=256)
+def _hash_canonical_request_cached(canonical_request):
+    """Cached hash_canonical_request for repeatedly presigned canonical requests"""
+    return hash_canonical_request(canonical_request)
 
 
 def calculate_signature_v2(secret_key, bucket, object_key, expiration):
@@ -17,43 +55,206 @@ def calculate_signature_v2(secret_key, bucket, object_key, expiration):
     Returns:
         Base64-encoded signature string
     """
-    string_to_sign = f"GET\n\n\n{expiration}\n/{bucket}/{object_key}"
+    string_to_sign = f"GET\n\n\n{expiration}\n/{bucket}/{object_key}".encode('utf-8')
+
+    signature = _hmac_digest(secret_key.encode('utf-8'), string_to_sign, 'sha1')
+
+    return _b2a_base64(signature, newline=False).decode('ascii')
+
+
+# Derived keys only change once per day per secret/region; the secret is part of
+# the cache key so rotated credentials never hit a stale entry
+@functools.lru_cache(maxsize=128)
+def _derive_signing_key(secret_key, datestamp, region):
+    """Derive the V4 signing key for the S3 service"""
+    def sign(key, msg):
+        return _hmac_digest(key, msg, 'sha256')
+
+    kDate = sign(('AWS4' + secret_key).encode('utf-8'), datestamp.encode('utf-8'))
+    kRegion = sign(kDate, region.encode('utf-8'))
+    kService = sign(kRegion, _S3)
+    return sign(kService, _AWS4_REQUEST)
+
 
-    signature = hmac.new(
-        secret_key.encode('utf-8'),
-        string_to_sign.encode('utf-8'),
-        hashlib.sha1
-    ).digest()
+@functools.lru_cache(maxsize=128)
+def _signing_hmac(secret_key, datestamp, region):
+    """Pre-keyed HMAC for the signing key; callers copy() it instead of re-keying"""
+    return _hmac_new(_derive_signing_key(secret_key, datestamp, region), None, _sha256)
 
-    return base64.b64encode(signature).decode('utf-8')
 
+@functools.lru_cache(maxsize=64)
+def _string_to_sign_hmac(secret_key, datestamp, region, timestamp, credential_scope):
+    """Signing HMAC with the string-to-sign prefix already absorbed
 
-def calculate_signature_v4(secret_key, datestamp, timestamp, credential_scope, canonical_request, region=''):
+    Everything but the canonical request hash is fixed for a given timestamp and
+    scope, so requests signed within the same second share this state.
+    """
+    if isinstance(timestamp, str):
+        timestamp = timestamp.encode('utf-8')
+    if isinstance(credential_scope, str):
+        credential_scope = credential_scope.encode('utf-8')
+
+    h = _signing_hmac(secret_key, datestamp, region).copy()
+    h.update(b'\n'.join((_ALGORITHM, timestamp, credential_scope, b'')))
+    return h
+
+
+# Per-thread prototypes, so signing threads never copy from the same HMAC object
+_thread_prototypes = threading.local()
+
+
+def _local_string_to_sign_hmac(secret_key, datestamp, region, timestamp, credential_scope):
+    """This thread's own copy of _string_to_sign_hmac for the given arguments"""
+    try:
+        prototypes = _thread_prototypes.by_key
+    except AttributeError:
+        prototypes = _thread_prototypes.by_key = {}
+    key = (secret_key, datestamp, region, timestamp, credential_scope)
+    h = prototypes.get(key)
+    if h is None:
+        # Timestamps change every second; keep only a bounded number of them per thread
+        if len(prototypes) >= 64:
+            prototypes.clear()
+        h = prototypes[key] = _string_to_sign_hmac(*key).copy()
+    return h
+
+
+def calculate_signature_v4(secret_key, datestamp, timestamp, credential_scope, canonical_request, region='',
+                           canonical_request_hash=None):
     """Calculate AWS Signature V4
 
     Args:
         secret_key: AWS secret key
         datestamp: Date in YYYYMMDD format
-        timestamp: ISO timestamp in YYYYMMDDTHHMMSSZ format
-        credential_scope: Credential scope string
-        canonical_request: Canonical request string
+        timestamp: ISO timestamp in YYYYMMDDTHHMMSSZ format (str, or pre-encoded bytes)
+        credential_scope: Credential scope string (str, or pre-encoded bytes)
+        canonical_request: Canonical request string (may be None if canonical_request_hash is given)
         region: AWS region (empty string for S3-compatible services)
+        canonical_request_hash: Precomputed hex SHA-256 of the canonical request, e.g. from a
+            hashlib.sha256 object the caller updated while building it
 
     Returns:
         Hex-encoded signature string
     """
-    # String to sign
-    algorithm = 'AWS4-HMAC-SHA256'
-    string_to_sign = f"{algorithm}\n{timestamp}\n{credential_scope}\n{hashlib.sha256(canonical_request.encode()).hexdigest()}"
+    return calculate_signature_v4_digest(
+        secret_key, datestamp, timestamp, credential_scope, canonical_request, region, canonical_request_hash
+    ).hex()
 
-    # Signing key
-    def sign(key, msg):
-        return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
 
-    kDate = sign(('AWS4' + secret_key).encode('utf-8'), datestamp)
-    kRegion = sign(kDate, region)
-    kService = sign(kRegion, 's3')
-    kSigning = sign(kService, 'aws4_request')
+def calculate_signature_v4_digest(secret_key, datestamp, timestamp, credential_scope, canonical_request, region='',
+                                  canonical_request_hash=None):
+    """Calculate AWS Signature V4 as raw bytes
+
+    Takes the same arguments as calculate_signature_v4.
+
+    Returns:
+        32-byte signature digest
+    """
+    if canonical_request_hash is None:
+        canonical_request_hash = _hash_canonical_request_cached(canonical_request).hex()
+
+    # Signature over the string to sign, whose prefix is already in this thread's HMAC
+    h = _local_string_to_sign_hmac(secret_key, datestamp, region, timestamp, credential_scope).copy()
+    h.update(canonical_request_hash.encode('utf-8'))
+    return h.digest()
+
+
+def calculate_signatures_v4_batch(secret_key, datestamp, timestamps, canonical_request_hashes, region=''):
+    """Calculate AWS Signature V4 for a batch of requests signed on the same day
+
+    The signing key and string-to-sign prefixes are derived once and shared by
+    every request in the batch, so each signature costs a single HMAC copy.
+
+    Args:
+        secret_key: AWS secret key
+        datestamp: Date in YYYYMMDD format
+        timestamps: ISO timestamps in YYYYMMDDTHHMMSSZ format (str or bytes), one per request
+        canonical_request_hashes: Hex-encoded SHA-256 hashes of the canonical requests
+        region: AWS region (empty string for S3-compatible services)
+
+    Returns:
+        List of hex-encoded signature strings
+    """
+    credential_scope = f"{datestamp}/{region}/s3/aws4_request"
+    signatures = []
+    for timestamp, canonical_request_hash in zip(timestamps, canonical_request_hashes, strict=True):
+        h = _local_string_to_sign_hmac(secret_key, datestamp, region, timestamp, credential_scope).copy()
+        h.update(canonical_request_hash.encode('ascii'))
+        signatures.append(h.hexdigest())
+    return signatures
+
+
+async def calculate_signature_v4_async(secret_key, datestamp, timestamp, credential_scope, canonical_request,
+                                       region='', canonical_request_hash=None):
+    """Calculate AWS Signature V4 on the signing thread pool
+
+    Takes the same arguments as calculate_signature_v4.
+
+    Returns:
+        Hex-encoded signature string
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _CRYPTO_POOL, calculate_signature_v4,
+        secret_key, datestamp, timestamp, credential_scope, canonical_request, region, canonical_request_hash
+    )
+
+
+async def calculate_signatures_v4_batch_async(secret_key, datestamp, timestamps, canonical_request_hashes, region=''):
+    """Calculate a batch of AWS Signature V4 on the signing thread pool
+
+    The batch is split into one slice per worker and all slices are submitted
+    at once. Takes the same arguments as calculate_signatures_v4_batch.
+
+    Returns:
+        List of hex-encoded signature strings, in input order
+    """
+    timestamps = list(timestamps)
+    canonical_request_hashes = list(canonical_request_hashes)
+    if len(timestamps) != len(canonical_request_hashes):
+        raise ValueError("timestamps and canonical_request_hashes must have the same length")
+
+    loop = asyncio.get_running_loop()
+    slice_size = -(-len(timestamps) // _CRYPTO_WORKERS) or 1
+    slices = await asyncio.gather(*(
+        loop.run_in_executor(
+            _CRYPTO_POOL, calculate_signatures_v4_batch,
+            secret_key, datestamp, timestamps[i:i + slice_size], canonical_request_hashes[i:i + slice_size], region
+        )
+        for i in range(0, len(timestamps), slice_size)
+    ))
+    return [signature for signatures in slices for signature in signatures]
+
+
+def make_v4_signer(secret_key, region=''):
+    """Build a V4 signing function specialised for one secret key and region
+
+    Each thread using the returned function keeps its own copy of the pre-keyed
+    HMAC for the last datestamp it saw, so a long-lived signer only consults the
+    shared signing key cache when the date changes and threads never copy from
+    the same prototype.
+
+    Args:
+        secret_key: AWS secret key
+        region: AWS region (empty string for S3-compatible services)
+
+    Returns:
+        Function taking (datestamp, timestamp, credential_scope, canonical_request)
+        as strings and returning the 32-byte signature digest
+    """
+    local = threading.local()
+
+    def sign_v4(datestamp, timestamp, credential_scope, canonical_request):
+        current_datestamp, signing_hmac = getattr(local, 'current', (None, None))
+        if current_datestamp != datestamp:
+            signing_hmac = _signing_hmac(secret_key, datestamp, region).copy()
+            local.current = (datestamp, signing_hmac)
+
+        canonical_request_hash = hash_canonical_request(canonical_request).hex()
+        string_to_sign = f"AWS4-HMAC-SHA256\n{timestamp}\n{credential_scope}\n{canonical_request_hash}"
+
+        h = signing_hmac.copy()
+        h.update(string_to_sign.encode('utf-8'))
+        return h.digest()
 
-    # Signature
-    return hmac.new(kSigning, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+    return sign_v4